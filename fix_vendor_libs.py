@@ -1,15 +1,30 @@
 #!/usr/bin/env python3
 
+import base64
+import bisect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import ctypes
+from dataclasses import asdict, dataclass, field, is_dataclass
 from enum import Enum
+import fcntl
+import functools
+import hashlib
+from itertools import chain, repeat
 import json
+import mmap
 import os
 from pathlib import Path
 import platform
 import re
 import shutil
+import stat
 import subprocess
+import struct
 import sys
 import tempfile
+import time
+import zipfile
 
 # Checks / fixes every lib in a vendor-PLATFORM.tar.gz archive according to the following rules.
 # This includes the libraries that are currently embedded inside wheels.
@@ -43,12 +58,14 @@ import tempfile
 
 USAGE = """
 
-Usage: fix_vendor_libs INPUT_PATH [OUTPUT_PATH]")
+Usage: fix_vendor_libs [--verify] INPUT_PATH [OUTPUT_PATH]")
     INPUT_PATH is the path to a vendor archive (eg vendor-Darwin.tar.gz),
         or a path to the uncompressed contents of a vendor archive.
     OUTPUT_PATH the path to which the fixed vendor archive is written.
         If not supplied, fix_vendor_libs runs in a dry-run mode where it fixes
         the archive in a temp directory, but doesn't output it anywhere.
+    --verify re-runs every check on every lib after fixing, instead of just
+        checking that each edited lib was edited as intended.
 """
 
 SITE_PACKAGES_PREFIX = "env/lib/python3.x/site-packages/"
@@ -108,7 +125,7 @@ elif PLATFORM == "Linux":
     ]
 
 
-SYSTEM_DEPS_ALLOW_SET = set(SYSTEM_DEPS_ALLOW_LIST)
+SYSTEM_DEPS_ALLOW_SET = frozenset(SYSTEM_DEPS_ALLOW_LIST)
 
 
 class PlatformSpecific:
@@ -137,36 +154,75 @@ def fatal(message, detail=None):
 
 
 def json_dumps(json_obj, root_path):
+    root_prefix = os.path.join(root_path, "")
+
     def default(unhandled):
         if isinstance(unhandled, Path):
+            path = str(unhandled)
+            # Nearly every path is inside root_path, and then there's nothing for relpath to normalize.
+            if path.startswith(root_prefix):
+                return path[len(root_prefix) :]
             return os.path.relpath(unhandled, root_path)
+        if is_dataclass(unhandled):
+            return asdict(unhandled)
         raise TypeError
 
     return json.dumps(json_obj, indent=2, default=default)
 
 
+# pigz uses every core to compress - if it's available, have tar use it instead of its builtin gzip.
+PIGZ = shutil.which("pigz")
+
+
+def tar_gzip_args():
+    return ["--use-compress-program", PIGZ] if PIGZ else ["-z"]
+
+
 def unpack_all(input_path, root_path):
     contents_path = root_path / VENDOR_ARCHIVE_CONTENTS
     contents_path.mkdir()
     if input_path.is_file():
         info(f"Extracting {input_path} to {root_path} ...")
-        subprocess.check_call(["tar", "-xzf", input_path, "--directory", contents_path])
+        subprocess.check_call(
+            [
+                "tar",
+                "-x",
+                *tar_gzip_args(),
+                "-f",
+                input_path,
+                "--directory",
+                contents_path,
+            ]
+        )
     else:
         info(f"Copying from {input_path} to {root_path} ...")
         for d in TOP_LEVEL_DIRECTORIES:
             assert (input_path / d).is_dir()
-            shutil.copytree(input_path / d, contents_path / d, symlinks=True)
+            shutil.copytree(
+                input_path / d,
+                contents_path / d,
+                symlinks=True,
+                copy_function=functools.partial(
+                    copy_file, copy_metadata=shutil.copystat
+                ),
+            )
 
     for d in TOP_LEVEL_DIRECTORIES:
         assert (contents_path / d).is_dir()
 
-    for path_to_wheel in wheel_paths(contents_path):
-        unpack_wheel(path_to_wheel, root_path)
+    # zlib releases the GIL, so wheels can be unpacked and re-packed in parallel on threads.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(unpack_wheel, wheel_paths(contents_path), repeat(root_path)))
 
 
-def pack_all(root_path, output_path):
-    for path_to_wheel in wheel_paths(root_path):
-        pack_wheel(path_to_wheel, root_path)
+def pack_all(root_path, output_path, modified_paths):
+    # Wheels that had nothing modified inside them are left as they are, rather than being re-packed.
+    modified_dirs = {p.relative_to(root_path).parts[0] for p in modified_paths}
+    modified_wheels = [
+        p for p in wheel_paths(root_path) if f"{p.name}-contents" in modified_dirs
+    ]
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(pack_wheel, modified_wheels, repeat(root_path)))
 
     info(f"Writing {output_path} ...")
     contents_path = root_path / VENDOR_ARCHIVE_CONTENTS
@@ -174,7 +230,9 @@ def pack_all(root_path, output_path):
     subprocess.check_call(
         [
             "tar",
-            "-czf",
+            "-c",
+            *tar_gzip_args(),
+            "-f",
             output_path,
             "--directory",
             contents_path,
@@ -183,77 +241,118 @@ def pack_all(root_path, output_path):
     )
 
 
+def walk_files(root_path):
+    # Yields os.DirEntry objects, which already know their own file type - so only the files we are
+    # interested in ever need to be stat-ed or turned into Paths.
+    dirs_to_scan = [root_path]
+    while dirs_to_scan:
+        with os.scandir(dirs_to_scan.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs_to_scan.append(entry.path)
+                else:
+                    yield entry
+
+
 def wheel_paths(root_path):
-    yield from root_path.glob("**/*.whl")
+    for entry in walk_files(root_path):
+        if entry.name.endswith(".whl"):
+            yield Path(entry.path)
 
 
 def unpack_wheel(path_to_wheel, root_path):
     wheel_name = path_to_wheel.name
+    wheel_contents_path = root_path / f"{wheel_name}-contents"
 
     info(f"Unpacking {wheel_name} ...")
-    subprocess.check_output(
-        [sys.executable, "-m", "wheel", "unpack", "--dest", root_path, path_to_wheel]
-    )
-
-    parts = wheel_name.split("-")
-    wheel_id = f"{parts[0]}-{parts[1]}"
-
-    wheel_contents_path = root_path / wheel_id
-    if not wheel_contents_path.is_dir():
+    try:
+        with zipfile.ZipFile(path_to_wheel) as zf:
+            for zinfo in zf.infolist():
+                extracted_path = zf.extract(zinfo, wheel_contents_path)
+                # zipfile doesn't restore permissions, but libs and scripts need to stay executable.
+                mode = zinfo.external_attr >> 16 & 0o777
+                if mode and not zinfo.is_dir():
+                    os.chmod(extracted_path, mode)
+    except zipfile.BadZipFile:
         fatal(f"Unpacking {wheel_name} didn't work as expected")
 
-    wheel_contents_path.rename(root_path / f"{wheel_name}-contents")
-
 
 def pack_wheel(path_to_wheel, root_path):
     wheel_name = path_to_wheel.name
-    dest_dir = path_to_wheel.parents[0]
     wheel_contents_path = root_path / f"{wheel_name}-contents"
     assert wheel_contents_path.is_dir()
 
     info(f"Re-packing {wheel_name} ...")
-    subprocess.check_output(
-        [
-            sys.executable,
-            "-m",
-            "wheel",
-            "pack",
-            "--dest-dir",
-            dest_dir,
-            wheel_contents_path,
-        ]
+    # Same layout as "wheel pack": the dist-info dir goes last, and RECORD is re-generated and goes very last.
+    paths = sorted(walk_files(wheel_contents_path), key=lambda e: e.path)
+    arcnames = [Path(e.path).relative_to(wheel_contents_path).as_posix() for e in paths]
+    dist_info = [
+        a.split("/")[0] for a in arcnames if a.split("/")[0].endswith(".dist-info")
+    ]
+    if not dist_info:
+        fatal(f"Re-packing {wheel_name} didn't work as expected - no .dist-info dir")
+    record_arcname = f"{dist_info[0]}/RECORD"
+    files = sorted(
+        (a.startswith(f"{dist_info[0]}/"), a, e.path)
+        for a, e in zip(arcnames, paths)
+        if a != record_arcname
     )
 
+    record_lines = []
+    with zipfile.ZipFile(
+        path_to_wheel, "w", zipfile.ZIP_DEFLATED, compresslevel=1
+    ) as zf:
+        for _, arcname, path in files:
+            # Each file is read once, in chunks, and both hashed for RECORD and written to the wheel.
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = zf.compression
+            zinfo._compresslevel = zf.compresslevel  # As ZipFile.write does.
+            digest = hashlib.sha256()
+            with open(path, "rb") as src, zf.open(zinfo, "w") as dest:
+                for chunk in iter(functools.partial(src.read, 1 << 20), b""):
+                    digest.update(chunk)
+                    dest.write(chunk)
+            digest = base64.urlsafe_b64encode(digest.digest()).rstrip(b"=").decode()
+            record_lines.append(f"{arcname},sha256={digest},{zinfo.file_size}\n")
+        record_lines.append(f"{record_arcname},,\n")
+
+        record_zinfo = zipfile.ZipInfo(record_arcname, time.localtime()[:6])
+        record_zinfo.compress_type = zf.compression
+        record_zinfo.external_attr = (stat.S_IFREG | 0o644) << 16
+        zf.writestr(record_zinfo, "".join(record_lines))
+
 
 def read_cmd_lines(cmd):
-    return subprocess.check_output(cmd, text=True).strip().splitlines()
+    # Output is left as bytes - callers decode only the parts they need.
+    return subprocess.check_output(cmd).strip().splitlines()
 
 
-def read_elf_cmd_lines(path_to_lib, pattern_to_read):
-    result = []
-    lines = read_cmd_lines(["readelf", "-d", path_to_lib])
-    for line in lines:
-        if pattern_to_read in line:
-            result.append(line.strip().split()[4].strip("[]"))
-    return result
+# LIB_EXTENSIONS that end in a wildcard (eg ".so.*") are matched anywhere in a name, the rest only at the end.
+LIB_EXT_SUFFIXES = tuple(ext for ext in LIB_EXTENSIONS if not ext.endswith("*"))
+LIB_EXT_INFIXES = tuple(ext[:-1] for ext in LIB_EXTENSIONS if ext.endswith("*"))
+
+
+def is_lib_name(name):
+    return name.endswith(LIB_EXT_SUFFIXES) or any(i in name for i in LIB_EXT_INFIXES)
 
 
 def lib_paths(root_path, is_symlink=False):
-    for ext in LIB_EXTENSIONS:
-        for path_to_lib in root_path.glob(f"**/*{ext}"):
-            if path_to_lib.is_symlink() == is_symlink:
-                yield path_to_lib
+    for entry in walk_files(root_path):
+        if entry.is_symlink() == is_symlink and is_lib_name(entry.name):
+            yield Path(entry.path)
 
 
 def remove_lib_ext(lib_name):
-    for ext in LIB_EXTENSIONS:
-        if lib_name.endswith(ext):
-            return lib_name[: -len(ext)]
-    return lib_name
+    return split_lib_ext(lib_name)[0]
+
+
+# Longest first, so that the extension found is the longest one that matches.
+LIB_EXT_SUFFIXES_BY_LENGTH = sorted(LIB_EXT_SUFFIXES, key=len, reverse=True)
 
 
+@functools.lru_cache(maxsize=4096)
 def split_lib_ext(lib_name):
-    for ext in LIB_EXTENSIONS:
+    for ext in LIB_EXT_SUFFIXES_BY_LENGTH:
         if lib_name.endswith(ext):
             return lib_name[: -len(ext)], ext
     return lib_name, ""
@@ -263,6 +362,7 @@ DOT_PLUS_DIGITS = r"\.[0-9]+"
 VERSION_PATTERN = re.compile("(" + DOT_PLUS_DIGITS + ")*$")
 
 
+@functools.lru_cache(maxsize=4096)
 def split_lib_version_suffix(lib_name):
     match = VERSION_PATTERN.search(lib_name)
     if match:
@@ -274,36 +374,665 @@ UNMODIFIED = 0
 MODIFIED = 1
 
 
-get_install_name = PlatformSpecific()
+@dataclass
+class LibMetadata:
+    """The install-name, deps and rpaths of a lib, as read from a single scan of the lib."""
+
+    install_name: str
+    deps: list
+    rpaths: list
+
+
+scan_lib_batch = PlatformSpecific()
+
+
+def split_batch_output(lines, paths, is_header):
+    """
+    Splits the output of a tool that was run on several libs at once into the output for each lib.
+    is_header(line, path) tells whether line is the header that the tool outputs before the output for path.
+    """
+    if len(paths) == 1:
+        return [lines]
+    result = [[] for _ in paths]
+    index = -1
+    for line in lines:
+        if index + 1 < len(paths) and is_header(line, os.fsencode(paths[index + 1])):
+            index += 1
+        elif index >= 0:
+            result[index].append(line)
+    return result
+
+
+# Load commands that otool -L reports as deps.
+DARWIN_DEP_COMMANDS = {
+    b"LC_LOAD_DYLIB",
+    b"LC_LOAD_WEAK_DYLIB",
+    b"LC_LOAD_UPWARD_DYLIB",
+    b"LC_LAZY_LOAD_DYLIB",
+    b"LC_REEXPORT_DYLIB",
+}
+
+# Matches either the "cmd" line that starts a load command, or the "name" / "path" line that gives its argument.
+OTOOL_PATTERN = re.compile(
+    rb"^[ \t]*(?:cmd (\S+)|(?:name|path) (.*) \(offset [0-9]+\))[ \t]*$", re.MULTILINE
+)
+
+
+def is_otool_header(line, path):
+    # Universal binaries get a header per architecture: "path (architecture arm64):"
+    return line == path + b":" or line.startswith(path + b" (architecture ")
+
+
+def scan_lib_batch_Darwin(paths):
+    # Most libs can be read in-process - otool is only needed for any that scan_macho_in_process can't read.
+    results = [scan_macho_in_process(p) for p in paths]
+    unread = [p for p, metadata in zip(paths, results) if metadata is None]
+    if not unread:
+        return results
+
+    # otool -l lists LC_ID_DYLIB, LC_RPATH and every LC_*_DYLIB load command, so it tells us everything
+    # that otool -D, otool -L and otool -l would tell us separately.
+    lines = read_cmd_lines(["otool", "-l", *unread])
+    otool_results = iter(
+        parse_otool_lines(lib_lines)
+        for lib_lines in split_batch_output(lines, unread, is_otool_header)
+    )
+    return [next(otool_results) if m is None else m for m in results]
+
 
+def parse_otool_lines(lines):
+    install_name = None
+    deps = []
+    rpaths = []
+    cmd = None
+    for match in OTOOL_PATTERN.finditer(b"\n".join(lines)):
+        if match.group(1) is not None:
+            cmd = match.group(1)
+            continue
+        arg = os.fsdecode(match.group(2))
+        if cmd == b"LC_ID_DYLIB":
+            install_name = arg
+        elif cmd == b"LC_RPATH":
+            rpaths.append(arg)
+        elif cmd in DARWIN_DEP_COMMANDS and arg.endswith(LIB_EXT_SUFFIXES):
+            deps.append(arg)
+    return LibMetadata(install_name or None, deps, rpaths)
+
+
+# From mach-o/fat.h and mach-o/loader.h
+FAT_MAGIC = 0xCAFEBABE
+FAT_MAGIC_64 = 0xCAFEBABF
+MH_MAGIC = 0xFEEDFACE
+MH_MAGIC_64 = 0xFEEDFACF
+LC_REQ_DYLD = 0x80000000
+LC_ID_DYLIB = 0xD
+LC_RPATH = 0x1C | LC_REQ_DYLD
+# The same load commands as DARWIN_DEP_COMMANDS.
+MACHO_DEP_COMMANDS = {
+    0xC,  # LC_LOAD_DYLIB
+    0x18 | LC_REQ_DYLD,  # LC_LOAD_WEAK_DYLIB
+    0x23 | LC_REQ_DYLD,  # LC_LOAD_UPWARD_DYLIB
+    0x20,  # LC_LAZY_LOAD_DYLIB
+    0x1F | LC_REQ_DYLD,  # LC_REEXPORT_DYLIB
+}
+# From mach/machine.h
+MACHO_CPU_TYPES = {"x86_64": 0x01000007, "arm64": 0x0100000C}
+
+
+def scan_macho_in_process(path_to_lib):
+    """Reads the load commands of a Mach-O file directly. Returns None if it can't be read that way."""
+    try:
+        with open(path_to_lib, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return read_macho_metadata(data)
+    except (OSError, ValueError, struct.error):
+        return None
 
-def get_install_name_Darwin(path_to_lib):
-    lines = read_cmd_lines(["otool", "-D", path_to_lib])
-    result = lines[1].strip() if len(lines) == 2 else None
-    return result if result else None
 
+def find_macho_header(data):
+    # Like otool, only looks at the slice for this machine's architecture if it's a universal binary.
+    (magic,) = struct.unpack_from(">I", data, 0)
+    if magic not in (FAT_MAGIC, FAT_MAGIC_64):
+        return 0
+    (nfat_arch,) = struct.unpack_from(">I", data, 4)
+    arch_fmt = ">iiIII" if magic == FAT_MAGIC else ">iiQQII"
+    arch_size = struct.calcsize(arch_fmt)
+    host_cputype = MACHO_CPU_TYPES.get(platform.machine())
+    for i in range(nfat_arch):
+        cputype, _, offset = struct.unpack_from(arch_fmt, data, 8 + i * arch_size)[:3]
+        if cputype == host_cputype:
+            return offset
+    # otool shows every slice in this case - leave that to otool.
+    return None
+
+
+def read_macho_metadata(data):
+    header_offset = find_macho_header(data)
+    if header_offset is None:
+        return None
+    (magic,) = struct.unpack_from("<I", data, header_offset)
+    endian = "<"
+    if magic not in (MH_MAGIC, MH_MAGIC_64):
+        (magic,) = struct.unpack_from(">I", data, header_offset)
+        endian = ">"
+    if magic not in (MH_MAGIC, MH_MAGIC_64):
+        return None
+    ncmds = struct.unpack_from(endian + "4xIII", data, header_offset + 4)[2]
+    offset = header_offset + (32 if magic == MH_MAGIC_64 else 28)
+
+    install_name = None
+    deps = []
+    rpaths = []
+    for i in range(ncmds):
+        cmd, cmdsize = struct.unpack_from(endian + "II", data, offset)
+        if cmdsize < 8:
+            return None
+        if cmd == LC_ID_DYLIB or cmd == LC_RPATH or cmd in MACHO_DEP_COMMANDS:
+            # All of these have the offset of their string argument right after cmdsize.
+            (arg_offset,) = struct.unpack_from(endian + "I", data, offset + 8)
+            end = data.find(b"\0", offset + arg_offset, offset + cmdsize)
+            arg = os.fsdecode(
+                data[offset + arg_offset : end if end != -1 else offset + cmdsize]
+            )
+            if cmd == LC_ID_DYLIB:
+                install_name = arg
+            elif cmd == LC_RPATH:
+                rpaths.append(arg)
+            elif arg.endswith(LIB_EXT_SUFFIXES):
+                deps.append(arg)
+        offset += cmdsize
+    return LibMetadata(install_name or None, deps, rpaths)
 
-def get_install_name_Linux(path_to_lib):
-    lines = read_cmd_lines(["patchelf", "--print-soname", path_to_lib])
-    result = lines[0].strip() if lines else None
-    return result if result else None
 
+READELF_VALUE_PATTERN = re.compile(rb"\((NEEDED|SONAME|RPATH|RUNPATH)\).*\[(.*)\]$")
 
-set_install_name = PlatformSpecific()
 
+def is_readelf_header(line, path):
+    return line == b"File: " + path
 
-def set_install_name_Darwin(path_to_lib, install_name):
-    subprocess.check_call(["install_name_tool", "-id", install_name, path_to_lib])
 
+def scan_lib_batch_Linux(paths):
+    # Most libs can be read in-process - readelf is only needed for any that ElfFile can't make sense of.
+    results = [scan_elf_in_process(p) for p in paths]
+    unread = [p for p, metadata in zip(paths, results) if metadata is None]
+    if not unread:
+        return results
+
+    # readelf -d lists the NEEDED, SONAME and RPATH / RUNPATH entries of the dynamic section all at once.
+    lines = read_cmd_lines(["readelf", "-d", *unread])
+    readelf_results = iter(
+        parse_readelf_lines(lib_lines)
+        for lib_lines in split_batch_output(lines, unread, is_readelf_header)
+    )
+    return [next(readelf_results) if m is None else m for m in results]
+
+
+def scan_elf_in_process(path_to_lib):
+    """Reads the dynamic section of an ELF file directly. Returns None if it can't be read that way."""
+    try:
+        with open(path_to_lib, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return ElfFile(data).get_metadata()
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def parse_readelf_lines(lines):
+    install_name = None
+    deps = []
+    rpaths = []
+    for line in lines:
+        if b"[" not in line:
+            continue
+        match = READELF_VALUE_PATTERN.search(line.strip())
+        if not match:
+            continue
+        tag, value = match.groups()
+        value = os.fsdecode(value)
+        if tag == b"NEEDED":
+            deps.append(value)
+        elif tag == b"SONAME":
+            install_name = value
+        elif value:
+            rpaths = value.split(":")
+    return LibMetadata(install_name or None, deps, rpaths)
+
+
+lib_metadata_cache = {}
+
+
+def get_lib_metadata(path_to_lib):
+    metadata = lib_metadata_cache.get(path_to_lib)
+    if metadata is None:
+        metadata = lib_metadata_cache[path_to_lib] = scan_lib_batch([path_to_lib])[0]
+    return metadata
+
+
+# Scanning or editing a lib is mostly spent waiting on a subprocess, so it is worth using more threads than cores.
+SCAN_WORKERS = (os.cpu_count() or 1) * 2
+
+# Each subprocess scans up to this many libs, so that process startup isn't paid for every lib.
+SCAN_BATCH_SIZE = 64
+
+
+def scan_libs(lib_paths_list):
+    """Scans every lib that isn't already cached, in parallel batches."""
+    unscanned = [p for p in lib_paths_list if p not in lib_metadata_cache]
+    if not unscanned:
+        return
+    # Small enough batches that every worker gets some.
+    batch_size = min(SCAN_BATCH_SIZE, -(-len(unscanned) // SCAN_WORKERS))
+    batches = [
+        unscanned[i : i + batch_size] for i in range(0, len(unscanned), batch_size)
+    ]
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        for batch, results in zip(batches, executor.map(scan_lib_batch, batches)):
+            lib_metadata_cache.update(zip(batch, results))
+
+
+def forget_lib_metadata(path_to_lib):
+    """Must be called whenever a lib is modified or moved so that it is re-scanned when next needed."""
+    lib_metadata_cache.pop(path_to_lib, None)
+
+
+def move_lib_metadata(path_to_lib, new_path):
+    """Renaming a lib doesn't change what's in it, so it doesn't need to be re-scanned."""
+    metadata = lib_metadata_cache.pop(path_to_lib, None)
+    if metadata is not None:
+        lib_metadata_cache[new_path] = metadata
+
+
+@dataclass
+class LibEdits:
+    """Edits that the fixers have queued up for a lib, so they can all be applied by a single subprocess."""
+
+    install_name: str = None
+    rpaths: list = None
+    changed_deps: list = field(default_factory=list)
+
+
+pending_edits = {}
+
+
+def queue_edits(path_to_lib):
+    return pending_edits.setdefault(path_to_lib, LibEdits())
+
+
+apply_edits = PlatformSpecific()
+
+
+def apply_edits_Darwin(path_to_lib, edits):
+    args = []
+    if edits.install_name:
+        args += ["-id", edits.install_name]
+    for old_dep, new_dep in edits.changed_deps:
+        args += ["-change", old_dep, new_dep]
+    if edits.rpaths is not None:
+        # Only rpaths that are changing are deleted / added - install_name_tool won't both delete and add
+        # the same rpath in one invocation.
+        old_rpaths = get_lib_metadata(path_to_lib).rpaths
+        for rpath in old_rpaths:
+            if rpath not in edits.rpaths:
+                args += ["-delete_rpath", rpath]
+        for rpath in edits.rpaths:
+            if rpath not in old_rpaths:
+                args += ["-add_rpath", rpath]
+    if args:
+        subprocess.check_call(["install_name_tool", *args, path_to_lib])
+
+
+# Constants from elf.h
+PT_LOAD = 1
+PT_DYNAMIC = 2
+SHT_STRTAB = 3
+SHT_DYNAMIC = 6
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6FFFFFFD
+SHT_GNU_VERNEED = 0x6FFFFFFE
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+DT_VERNEED = 0x6FFFFFFE
+DT_VERNEEDNUM = 0x6FFFFFFF
+# Dynamic entries whose values are offsets into the dynamic string table.
+DT_STRING_TAGS = {
+    DT_NEEDED,
+    DT_SONAME,
+    DT_RPATH,
+    DT_RUNPATH,
+    0x6FFFFEFA,  # DT_CONFIG
+    0x6FFFFEFB,  # DT_DEPAUDIT
+    0x6FFFFEFC,  # DT_AUDIT
+    0x7FFFFFFD,  # DT_AUXILIARY
+    0x7FFFFFFF,  # DT_FILTER
+}
+
+
+class ElfFile:
+    """
+    Just enough of an ELF file to read the NEEDED, SONAME, and RPATH / RUNPATH entries of its dynamic section,
+    and to edit them as long as that can be done without growing the file - by pointing entries at strings that are already
+    in the dynamic string table, or by overwriting a string that nothing else uses with a shorter one.
+    """
+
+    def __init__(self, data):
+        if data[:4] != b"\x7fELF" or data[4] not in (1, 2) or data[5] not in (1, 2):
+            raise ValueError("Not a recognised ELF file")
+        self.data = data
+        self.writes = []
+        self.is_64 = data[4] == 2
+        self.endian = "<" if data[5] == 1 else ">"
+        self.addr = "Q" if self.is_64 else "I"
+
+        header = self.unpack("16sHHI3" + self.addr + "I6H", 0)
+        phoff, shoff, phentsize, phnum, shentsize, shnum = header[5:7] + header[9:13]
+
+        # Program headers - p_type, p_offset, p_vaddr, p_filesz
+        self.segments = []
+        for i in range(phnum):
+            if self.is_64:
+                p = self.unpack("IIQQQQQQ", phoff + i * phentsize)
+                self.segments.append((p[0], p[2], p[3], p[5]))
+            else:
+                p = self.unpack("8I", phoff + i * phentsize)
+                self.segments.append((p[0], p[1], p[2], p[4]))
+
+        # Section headers - sh_type, sh_offset, sh_size, sh_link, sh_entsize
+        self.sections = []
+        for i in range(shnum if shoff else 0):
+            sh = self.unpack(
+                "II4" + self.addr + "II2" + self.addr, shoff + i * shentsize
+            )
+            self.sections.append((sh[1], sh[4], sh[5], sh[6], sh[9]))
+
+        dynamic = [s for s in self.segments if s[0] == PT_DYNAMIC]
+        if not dynamic:
+            raise ValueError("ELF file has no dynamic section")
+        self.dyn_entry_size = 16 if self.is_64 else 8
+        self.dyn_entries = []
+        offset, end = dynamic[0][1], dynamic[0][1] + dynamic[0][3]
+        while offset < end:
+            tag, val = self.unpack("qQ" if self.is_64 else "iI", offset)
+            if tag == DT_NULL:
+                break
+            self.dyn_entries.append((offset, tag, val))
+            offset += self.dyn_entry_size
+
+        self.strtab = self.vaddr_to_offset(self.dyn_value(DT_STRTAB))
+        self.strsz = self.dyn_value(DT_STRSZ)
+
+    def unpack(self, fmt, offset):
+        return struct.unpack_from(self.endian + fmt, self.data, offset)
+
+    def write(self, fmt, offset, *values):
+        struct.pack_into(self.endian + fmt, self.data, offset, *values)
+        self.writes.append((offset, struct.calcsize(self.endian + fmt)))
+        # Keep the parsed dynamic entries up to date, so that later edits see what earlier ones changed.
+        for i, (entry_offset, _, _) in enumerate(self.dyn_entries):
+            if entry_offset <= offset < entry_offset + self.dyn_entry_size:
+                tag, val = self.unpack("qQ" if self.is_64 else "iI", entry_offset)
+                self.dyn_entries[i] = (entry_offset, tag, val)
+
+    def dyn_value(self, tag):
+        values = [val for offset, t, val in self.dyn_entries if t == tag]
+        if len(values) != 1:
+            raise ValueError(f"Expected one dynamic entry with tag {tag}")
+        return values[0]
+
+    def vaddr_to_offset(self, vaddr):
+        for p_type, p_offset, p_vaddr, p_filesz in self.segments:
+            if p_type == PT_LOAD and p_vaddr <= vaddr < p_vaddr + p_filesz:
+                return vaddr - p_vaddr + p_offset
+        raise ValueError(f"Address {vaddr:#x} is not in any segment")
+
+    def string_at(self, str_offset):
+        start = self.strtab + str_offset
+        end = self.data.find(b"\0", start, self.strtab + self.strsz)
+        if end == -1:
+            raise ValueError(f"String at {str_offset:#x} is not in the string table")
+        return bytes(self.data[start:end])
+
+    def get_metadata(self):
+        install_name = None
+        deps = []
+        rpaths = []
+        for _, tag, val in self.dyn_entries:
+            if tag == DT_NEEDED:
+                deps.append(os.fsdecode(self.string_at(val)))
+            elif tag == DT_SONAME:
+                install_name = os.fsdecode(self.string_at(val))
+            elif tag in (DT_RPATH, DT_RUNPATH) and self.string_at(val):
+                rpaths = os.fsdecode(self.string_at(val)).split(":")
+        return LibMetadata(install_name or None, deps, rpaths)
+
+    # A string field is a tuple of (file offset, struct format, current string value) for anything in
+    # the file that holds an offset into the dynamic string table.
+
+    def dyn_string_fields(self, *tags):
+        # The d_val of each dynamic entry with one of the given tags.
+        d_val_offset = self.dyn_entry_size // 2
+        return [
+            (offset + d_val_offset, self.addr, self.string_at(val))
+            for offset, tag, val in self.dyn_entries
+            if tag in tags
+        ]
 
-def set_install_name_Linux(path_to_lib, install_name):
-    subprocess.check_call(["patchelf", "--set-soname", install_name, path_to_lib])
+    def verneed_file_fields(self):
+        # The vn_file of each library that versioned symbols are needed from.
+        result = []
+        if not any(tag == DT_VERNEED for _, tag, _ in self.dyn_entries):
+            return result
+        offset = self.vaddr_to_offset(self.dyn_value(DT_VERNEED))
+        for i in range(self.dyn_value(DT_VERNEEDNUM)):
+            vn_file, vn_aux, vn_next = self.unpack("4xIII", offset)
+            result.append((offset + 4, "I", self.string_at(vn_file)))
+            offset += vn_next
+        return result
+
+    def all_string_refs(self):
+        # Every offset into the dynamic string table that something in the file refers to - or None if
+        # that can't be known for certain, eg because the section headers have been stripped.
+        strtab_indices = [
+            i
+            for i, (sh_type, sh_offset, _, _, _) in enumerate(self.sections)
+            if sh_type == SHT_STRTAB and sh_offset == self.strtab
+        ]
+        if len(strtab_indices) != 1:
+            return None
+        refs = [val for _, tag, val in self.dyn_entries if tag in DT_STRING_TAGS]
+        for sh_type, sh_offset, sh_size, sh_link, sh_entsize in self.sections:
+            if sh_link != strtab_indices[0]:
+                continue
+            if sh_type == SHT_DYNSYM:
+                for offset in range(sh_offset, sh_offset + sh_size, sh_entsize):
+                    refs.append(self.unpack("I", offset)[0])
+            elif sh_type == SHT_GNU_VERNEED:
+                offset = sh_offset
+                while True:
+                    vn_cnt, vn_file, vn_aux, vn_next = self.unpack("2xHIII", offset)
+                    refs.append(vn_file)
+                    aux_offset = offset + vn_aux
+                    for i in range(vn_cnt):
+                        vna_name, vna_next = self.unpack("8xII", aux_offset)
+                        refs.append(vna_name)
+                        aux_offset += vna_next
+                    if not vn_next:
+                        break
+                    offset += vn_next
+            elif sh_type == SHT_GNU_VERDEF:
+                offset = sh_offset
+                while True:
+                    vd_cnt, vd_aux, vd_next = self.unpack("6xH4xII", offset)
+                    aux_offset = offset + vd_aux
+                    for i in range(vd_cnt):
+                        vda_name, vda_next = self.unpack("II", aux_offset)
+                        refs.append(vda_name)
+                        aux_offset += vda_next
+                    if not vd_next:
+                        break
+                    offset += vd_next
+            elif sh_type != SHT_DYNAMIC:
+                return None
+        return refs
+
+    def set_string(self, fields, new_string):
+        """
+        Points every one of the given string fields at new_string. Returns False, having changed nothing,
+        if that can't be done without growing the string table.
+        """
+        if not fields:
+            return True
+        new_string = os.fsencode(new_string)
+        if b"\0" in new_string:
+            return False
+
+        # The new string might already be in the string table, possibly as the end of a longer string.
+        found = self.data.find(
+            new_string + b"\0", self.strtab, self.strtab + self.strsz
+        )
+        if found != -1:
+            for field_offset, field_fmt, _ in fields:
+                self.write(field_fmt, field_offset, found - self.strtab)
+            return True
+
+        # Otherwise, overwrite the old string, as long as it is the same string for all the fields, it is
+        # long enough, and nothing else refers to any part of it.
+        old_offsets = {self.unpack(fmt, offset)[0] for offset, fmt, _ in fields}
+        if len(old_offsets) != 1:
+            return False
+        old_offset, old_string = old_offsets.pop(), fields[0][2]
+        old_end = old_offset + len(old_string)
+        if len(new_string) > len(old_string):
+            return False
+        # Linkers merge a string into the tail of a longer one that ends with it, eg "libbar.so" into
+        # "/path/to/libbar.so" - only a string that starts straight after a NUL is not part of another.
+        if old_offset != 0 and self.data[self.strtab + old_offset - 1] != 0:
+            return False
+        refs = self.all_string_refs()
+        if refs is None:
+            return False
+        refs_to_old_string = [r for r in refs if old_offset <= r <= old_end]
+        if refs_to_old_string != [old_offset] * len(fields):
+            return False
+        padded = new_string.ljust(len(old_string) + 1, b"\0")
+        self.data[self.strtab + old_offset : self.strtab + old_end + 1] = padded
+        self.writes.append((self.strtab + old_offset, len(padded)))
+        return True
+
+    def set_soname(self, soname):
+        return self.set_string(self.dyn_string_fields(DT_SONAME), soname)
+
+    def set_rpath(self, rpath):
+        fields = self.dyn_string_fields(DT_RPATH, DT_RUNPATH)
+        if not fields or not self.set_string(fields, rpath):
+            return False
+        # Like patchelf, convert DT_RPATH to DT_RUNPATH unless the lib already has a DT_RUNPATH.
+        tags = [tag for _, tag, _ in self.dyn_entries]
+        if DT_RUNPATH not in tags:
+            for offset, tag, val in self.dyn_entries:
+                if tag == DT_RPATH:
+                    self.write("q" if self.is_64 else "i", offset, DT_RUNPATH)
+        return True
+
+    def replace_needed(self, old_dep, new_dep):
+        old_dep = os.fsencode(old_dep)
+        fields = [
+            field
+            for field in self.dyn_string_fields(DT_NEEDED) + self.verneed_file_fields()
+            if field[2] == old_dep
+        ]
+        return self.set_string(fields, new_dep)
+
+    def save(self, path):
+        with open(path, "r+b") as f:
+            for offset, size in self.writes:
+                f.seek(offset)
+                f.write(self.data[offset : offset + size])
+
+
+def edit_elf_in_place(path_to_lib, edits):
+    """
+    Makes the edits without patchelf, if they can all be made without growing the file.
+    Returns False, having changed nothing, if not.
+    """
+    with open(path_to_lib, "rb") as f:
+        data = bytearray(f.read())
+    try:
+        elf = ElfFile(data)
+        if edits.install_name and not elf.set_soname(edits.install_name):
+            return False
+        if edits.rpaths is not None and not elf.set_rpath(":".join(edits.rpaths)):
+            return False
+        for old_dep, new_dep in edits.changed_deps:
+            if not elf.replace_needed(old_dep, new_dep):
+                return False
+    except (ValueError, struct.error):
+        return False
+    elf.save(path_to_lib)
+    return True
+
+
+def apply_edits_Linux(path_to_lib, edits):
+    # patchelf re-writes the whole file, and is often needed anyway to make room for a longer string,
+    # but most edits to deps just shorten an absolute path to a name that is already in the string table.
+    if edit_elf_in_place(path_to_lib, edits):
+        return
+    args = []
+    if edits.install_name:
+        args += ["--set-soname", edits.install_name]
+    if edits.rpaths is not None:
+        args += ["--set-rpath", ":".join(edits.rpaths)]
+    for old_dep, new_dep in edits.changed_deps:
+        args += ["--replace-needed", old_dep, new_dep]
+    if args:
+        subprocess.check_call(["patchelf", *args, path_to_lib])
+
+
+def apply_all_edits():
+    applied_edits = dict(pending_edits)
+    pending_edits.clear()
+    # Each lib has all of its edits applied at once, so no two workers ever edit the same file.
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        # list() so that any exception raised while editing is re-raised here.
+        list(executor.map(apply_edits, applied_edits.keys(), applied_edits.values()))
+    for path_to_lib in applied_edits:
+        forget_lib_metadata(path_to_lib)
+    return applied_edits
+
+
+def check_edits(root_path, applied_edits):
+    """Re-scans just the libs that were edited, and checks that every edit took effect."""
+    problems = []
+    scan_libs(list(applied_edits))
+
+    for path_to_lib, edits in applied_edits.items():
+        metadata = get_lib_metadata(path_to_lib)
+        if (
+            (edits.install_name and metadata.install_name != edits.install_name)
+            or (edits.rpaths is not None and set(metadata.rpaths) != set(edits.rpaths))
+            or any(new_dep not in metadata.deps for _, new_dep in edits.changed_deps)
+        ):
+            problems.append({"lib": path_to_lib, "edits": edits, "actual": metadata})
+
+    if problems:
+        detail = json_dumps(problems, root_path)
+        fatal(
+            f"Checking edits: found {len(problems)} libs where the edits didn't take effect.",
+            detail=detail,
+        )
+    checkmark(f"Checking edits: all {len(applied_edits)} edited libs were edited.")
 
 
-def fix_names(root_path, make_fatal=False, verbose=False):
+def fix_names(root_path, lib_paths_list, make_fatal=False, verbose=False):
     problems = []
-    for path_to_lib in lib_paths(root_path):
-        install_name = get_install_name(path_to_lib)
+    scan_libs(lib_paths_list)
+
+    for path_to_lib in lib_paths_list:
+        install_name = get_lib_metadata(path_to_lib).install_name
         proposed_name = path_to_lib.name
         if install_name and install_name != proposed_name:
             problems.append(
@@ -333,61 +1062,19 @@ def fix_names(root_path, make_fatal=False, verbose=False):
         if path_to_lib.name != proposed_name:
             rename_path = path_to_lib.parents[0] / proposed_name
             path_to_lib.rename(rename_path)
+            forget_dir_index(path_to_lib.parents[0])
+            move_lib_metadata(path_to_lib, rename_path)
+            if path_to_lib in pending_edits:
+                pending_edits[rename_path] = pending_edits.pop(path_to_lib)
+            lib_paths_list[lib_paths_list.index(path_to_lib)] = rename_path
             path_to_lib = rename_path
 
         if install_name != proposed_name:
-            set_install_name(path_to_lib, path_to_lib.name)
+            queue_edits(path_to_lib).install_name = path_to_lib.name
 
     return MODIFIED
 
 
-get_rpaths = PlatformSpecific()
-
-
-def get_rpaths_Darwin(path_to_lib):
-    rpaths = []
-    lines = read_cmd_lines(["otool", "-l", path_to_lib])
-    for i, line in enumerate(lines):
-        if "RPATH" in line:
-            rpaths.append(lines[i + 2].split()[1])
-    return rpaths
-
-
-def get_rpaths_Linux(path_to_lib):
-    lines = read_cmd_lines(["patchelf", "--print-rpath", path_to_lib])
-    if not lines or not lines[0]:
-        return []
-    return lines[0].split(":")
-
-
-set_sole_rpaths = PlatformSpecific()
-
-
-def set_sole_rpaths_Darwin(path_to_lib, rpaths):
-    remove_all_rpaths_Darwin(path_to_lib)
-    for rpath in rpaths:
-        subprocess.check_call(["install_name_tool", "-add_rpath", rpath, path_to_lib])
-
-
-def set_sole_rpaths_Linux(path_to_lib, rpaths):
-    rpaths = ":".join(rpaths)
-    subprocess.check_call(["patchelf", "--set-rpath", rpaths, path_to_lib])
-
-
-remove_all_rpaths = PlatformSpecific()
-
-
-def remove_all_rpaths_Darwin(path_to_lib):
-    for rpath in get_rpaths_Darwin(path_to_lib):
-        subprocess.check_call(
-            ["install_name_tool", "-delete_rpath", rpath, path_to_lib]
-        )
-
-
-def remove_all_rpaths_Linux(path_to_lib):
-    subprocess.check_call(["patchelf", "--remove-rpath", path_to_lib])
-
-
 def get_eventual_path(path_to_lib):
     path_to_lib = str(path_to_lib)
     path_within_contents = path_to_lib.split("-contents/", maxsplit=1)[1]
@@ -397,26 +1084,54 @@ def get_eventual_path(path_to_lib):
 
 
 def propose_rpaths(eventual_lib_path):
-    path_to_env_lib = os.path.relpath("env/lib/", Path(eventual_lib_path).parents[0])
+    # The answer only depends on the folder, and most folders hold many libs.
+    return list(propose_rpaths_for_folder(os.path.dirname(eventual_lib_path) or "."))
+
+
+@functools.lru_cache(maxsize=None)
+def propose_rpaths_for_folder(eventual_folder):
+    path_to_env_lib = os.path.relpath("env/lib/", eventual_folder)
     if path_to_env_lib == ".":
-        return [LOADER_PATH]
+        return (LOADER_PATH,)
     path_to_env_lib = path_to_env_lib.rstrip("/") + "/"
-    return [LOADER_PATH, f"{LOADER_PATH}/{path_to_env_lib}"]
+    return (LOADER_PATH, f"{LOADER_PATH}/{path_to_env_lib}")
 
 
-def fix_rpaths(root_path, make_fatal=False, verbose=False):
-    problems = []
-    for path_to_lib in lib_paths(root_path):
-        actual_rpaths = get_rpaths(path_to_lib)
+@dataclass
+class LibLocation:
+    """Where a lib will eventually be installed, and so which rpaths it should have."""
+
+    eventual_path: str
+    proposed_rpaths: list
+
+
+# Unlike LibMetadata, a LibLocation never goes stale - editing a lib doesn't move it.
+lib_location_cache = {}
+
+
+def get_lib_location(path_to_lib):
+    location = lib_location_cache.get(path_to_lib)
+    if location is None:
         eventual_path = get_eventual_path(path_to_lib)
-        proposed_rpaths = propose_rpaths(eventual_path)
-        if set(actual_rpaths) != set(proposed_rpaths):
+        location = LibLocation(eventual_path, propose_rpaths(eventual_path))
+        lib_location_cache[path_to_lib] = location
+    return location
+
+
+def fix_rpaths(root_path, lib_paths_list, make_fatal=False, verbose=False):
+    problems = []
+    scan_libs(lib_paths_list)
+
+    for path_to_lib in lib_paths_list:
+        actual_rpaths = get_lib_metadata(path_to_lib).rpaths
+        location = get_lib_location(path_to_lib)
+        if set(actual_rpaths) != set(location.proposed_rpaths):
             problems.append(
                 {
                     "lib": path_to_lib,
-                    "eventual_path": eventual_path,
+                    "eventual_path": location.eventual_path,
                     "actual_rpaths": actual_rpaths,
-                    "proposed_rpaths": proposed_rpaths,
+                    "proposed_rpaths": location.proposed_rpaths,
                 }
             )
 
@@ -432,28 +1147,11 @@ def fix_rpaths(root_path, make_fatal=False, verbose=False):
     )
 
     for problem in problems:
-        set_sole_rpaths(problem["lib"], problem["proposed_rpaths"])
+        queue_edits(problem["lib"]).rpaths = problem["proposed_rpaths"]
 
     return MODIFIED
 
 
-get_deps = PlatformSpecific()
-
-
-def get_deps_Darwin(path_to_lib):
-    deps = []
-    lines = read_cmd_lines(["otool", "-L", path_to_lib])
-    for line in lines[1:]:
-        dep = line.strip().split()[0]
-        if any(dep.endswith(ext) for ext in LIB_EXTENSIONS):
-            deps.append(dep)
-    return deps
-
-
-def get_deps_Linux(path_to_lib):
-    return read_elf_cmd_lines(path_to_lib, "(NEEDED)")
-
-
 def sorted_good_and_bad_deps(good_deps, bad_deps):
     output = []
     for dep in sorted(good_deps | bad_deps, key=lambda dep: Path(dep).name):
@@ -462,31 +1160,21 @@ def sorted_good_and_bad_deps(good_deps, bad_deps):
     return "\n".join(output)
 
 
-change_dep = PlatformSpecific()
-
-
-def change_dep_Darwin(path_to_lib, old_dep, new_dep):
-    subprocess.check_call(
-        ["install_name_tool", "-change", old_dep, new_dep, path_to_lib]
-    )
-
-
-def change_dep_Linux(path_to_lib, old_dep, new_dep):
-    subprocess.check_call(
-        ["patchelf", "--replace-needed", old_dep, new_dep, path_to_lib]
-    )
-
-
+@functools.lru_cache(maxsize=4096)
 def get_pattern_for_dep(dep):
+    # Returns the unversioned name of the dep, and a prefix and regex matching any versioned name of the dep -
+    # the equivalent of the glob pattern base_name.*ext.
     base_name, ext = split_lib_ext(Path(dep).name)
     base_name, version_suffix = split_lib_version_suffix(base_name)
-    return base_name + ext, base_name + ".*" + ext
+    prefix = base_name + "."
+    pattern = re.compile(re.escape(prefix) + ".*" + re.escape(ext), re.DOTALL)
+    return base_name + ext, prefix, pattern
 
 
 def lib_names_match(dep1, dep2):
     base1, ext1 = split_lib_ext(Path(dep1).name)
-    base2, ext2 = split_lib_ext(Path(dep1).name)
-    return ext1 == ext2 and base1.startswith(base2) or base2.startswith(base1)
+    base2, ext2 = split_lib_ext(Path(dep2).name)
+    return ext1 == ext2 and (base1.startswith(base2) or base2.startswith(base1))
 
 
 class FindDepResult(Enum):
@@ -502,20 +1190,89 @@ ALLOWED_SYSTEM_DEP = FindDepResult.ALLOWED_SYSTEM_DEP
 UNEXPECTED_SYSTEM_DEP = FindDepResult.UNEXPECTED_SYSTEM_DEP
 
 
+dir_index_cache = {}
+
+
+def get_dir_index(folder):
+    """Returns a dict of {name: os.DirEntry} for everything in folder, listing each folder only once."""
+    index = dir_index_cache.get(folder)
+    if index is None:
+        try:
+            with os.scandir(folder) as entries:
+                index = {entry.name: entry for entry in entries}
+        except OSError:
+            index = {}
+        dir_index_cache[folder] = index
+    return index
+
+
+sorted_names_cache = {}
+
+
+def get_sorted_names(folder):
+    names = sorted_names_cache.get(folder)
+    if names is None:
+        names = sorted_names_cache[folder] = sorted(get_dir_index(folder))
+    return names
+
+
+versioned_names_cache = {}
+
+
+def get_versioned_names(folder):
+    """Returns a dict of {unversioned name: [versioned names, sorted]} for every versioned lib name in folder."""
+    versioned_names = versioned_names_cache.get(folder)
+    if versioned_names is None:
+        versioned_names = versioned_names_cache[folder] = {}
+        for name in get_sorted_names(folder):
+            base_name, ext = split_lib_ext(name)
+            base_name, version_suffix = split_lib_version_suffix(base_name)
+            if version_suffix:
+                # Names are already sorted, so each list stays sorted as it's appended to.
+                versioned_names.setdefault(base_name + ext, []).append(name)
+    return versioned_names
+
+
+def forget_dir_index(folder):
+    """Must be called whenever the contents of a folder change."""
+    dir_index_cache.pop(folder, None)
+    sorted_names_cache.pop(folder, None)
+    versioned_names_cache.pop(folder, None)
+    find_dep_in_search_paths.cache_clear()
+
+
 def resolve_lib_in_folder(folder, lib_name):
     if lib_name is None:
         return None
-    unresolved = folder / Path(lib_name).name
-    if not unresolved.is_file():
+    lib_name = Path(lib_name).name
+    entry = get_dir_index(folder).get(lib_name)
+    if entry is None or not entry.is_file():
         return None
-    if unresolved.is_symlink():
-        symlinked_to_name = unresolved.resolve()
+    if entry.is_symlink():
+        # Only the name of the target matters, so there's no need to canonicalize the whole path.
+        symlinked_to_name = os.path.basename(os.readlink(entry.path))
         return resolve_lib_in_folder(folder, symlinked_to_name)
     else:
-        return unresolved
+        return folder / lib_name
+
+
+def find_names_in_folder(folder, prefix, pattern):
+    # Only names that start with prefix can match, and they are all next to each other once sorted.
+    names = get_sorted_names(folder)
+    for i in range(bisect.bisect_left(names, prefix), len(names)):
+        if not names[i].startswith(prefix):
+            break
+        if pattern.fullmatch(names[i]):
+            yield names[i]
 
 
 def find_dep(dep_str, search_paths):
+    # Most libs share the same search paths, so most deps have already been looked for.
+    return find_dep_in_search_paths(dep_str, tuple(search_paths))
+
+
+@functools.lru_cache(maxsize=None)
+def find_dep_in_search_paths(dep_str, search_paths):
     if dep_str in SYSTEM_DEPS_ALLOW_SET:
         return ALLOWED_SYSTEM_DEP, None
 
@@ -533,41 +1290,80 @@ def find_dep(dep_str, search_paths):
         if dep_path:
             return VENDOR_DEP_FOUND, dep_path
 
-    dep_name_base, dep_name_pattern = get_pattern_for_dep(dep_name)
+    dep_name_base, dep_name_prefix, dep_name_pattern = get_pattern_for_dep(dep_name)
     for search_path in search_paths:
-        dep_path = resolve_lib_in_folder(search_path, dep_name_base)
-        if not dep_path:
-            dep_path = resolve_lib_in_folder(
-                search_path, next(iter(search_path.glob(dep_name_pattern)), None)
-            )
-        if dep_path and lib_names_match(dep_str, dep_path):
-            return VENDOR_DEP_FOUND, dep_path
+        # Several names in a folder can be candidates, but only some of them will match the dep - eg on
+        # Linux, libfoo.so.1 can't be satisfied by libfoo.so, only by libfoo.so.1.2 - so try each in turn.
+        candidates = chain(
+            [dep_name_base],
+            # Usually a matching name only differs by its version suffix, which is a single lookup.
+            get_versioned_names(search_path).get(dep_name_base, []),
+            find_names_in_folder(search_path, dep_name_prefix, dep_name_pattern),
+        )
+        for candidate in candidates:
+            dep_path = resolve_lib_in_folder(search_path, candidate)
+            if dep_path and lib_names_match(dep_str, dep_path):
+                return VENDOR_DEP_FOUND, dep_path
 
     return VENDOR_DEP_NOT_FOUND, None
 
 
-def fix_unsatisfied_deps(root_path, make_fatal=False, verbose=False):
+clone_file = PlatformSpecific()
+
+
+def clone_file_Darwin(src_path, dest_path):
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.clonefile(os.fsencode(src_path), os.fsencode(dest_path), 0) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), str(dest_path))
+
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def clone_file_Linux(src_path, dest_path):
+    with open(src_path, "rb") as src, open(dest_path, "wb") as dest:
+        fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+
+
+def copy_file(src_path, dest_path, copy_metadata=shutil.copymode):
+    # A clone shares its data with the original until one of them is modified, so costs almost nothing -
+    # but it only works within a filesystem that supports it (APFS, btrfs, XFS), so fall back to copying.
+    try:
+        clone_file(src_path, dest_path)
+    except OSError:
+        shutil.copyfile(src_path, dest_path)
+    copy_metadata(src_path, dest_path)
+
+
+def fix_unsatisfied_deps(root_path, lib_paths_list, make_fatal=False, verbose=False):
     env_lib_path = root_path / VENDOR_ARCHIVE_CONTENTS / "env" / "lib"
 
-    lib_paths_list = list(lib_paths(root_path))
+    scan_libs(lib_paths_list)
 
     deps_by_result = {key: set() for key in FindDepResult}
     vendor_deps_found_outside = []
 
-    for path_to_lib in lib_paths_list:
-        install_name = get_install_name(path_to_lib)
+    # Libs found outside the archive are themselves checked for deps, until no new libs are found.
+    seen = set(lib_paths_list)
+    worklist = deque(lib_paths_list)
+    while worklist:
+        path_to_lib = worklist.popleft()
+        metadata = get_lib_metadata(path_to_lib)
         search_paths = [
             env_lib_path,
             path_to_lib.parents[0],
-            *[Path(rpath) for rpath in get_rpaths(path_to_lib)],
+            *[Path(rpath) for rpath in metadata.rpaths],
         ]
 
-        for dep in get_deps(path_to_lib):
-            if dep == install_name:
+        for dep in metadata.deps:
+            if dep == metadata.install_name:
                 continue
             result, found_path = find_dep(dep, search_paths)
-            if found_path and found_path not in lib_paths_list:
-                lib_paths_list.append(found_path)
+            if found_path and found_path not in seen:
+                seen.add(found_path)
+                worklist.append(found_path)
                 vendor_deps_found_outside.append(found_path)
 
     if deps_by_result[UNEXPECTED_SYSTEM_DEP]:
@@ -583,7 +1379,7 @@ def fix_unsatisfied_deps(root_path, make_fatal=False, verbose=False):
 
     if deps_by_result[VENDOR_DEP_NOT_FOUND]:
         detail = sorted_good_and_bad_deps(
-            set(Path(lib).name for lib in lib_paths_list),
+            set(Path(lib).name for lib in seen),
             deps_by_result[VENDOR_DEP_NOT_FOUND],
         )
         count = len(deps_by_result[VENDOR_DEP_NOT_FOUND])
@@ -608,25 +1404,46 @@ def fix_unsatisfied_deps(root_path, make_fatal=False, verbose=False):
     for src_path in vendor_deps_found_outside:
         dest_path = env_lib_path / src_path.name
         if not dest_path.exists():
-            shutil.copy(src_path, dest_path)
+            copy_file(src_path, dest_path)
+            if is_lib_name(dest_path.name):
+                lib_paths_list.append(dest_path)
+    forget_dir_index(env_lib_path)
 
     return MODIFIED
 
 
-def fix_dep_linkage(root_path, make_fatal=False, verbose=False):
+def is_linked_by_name(dep, search_paths):
+    # A cheap way of telling that find_dep would find a lib with the same name as the dep, so that there'd
+    # be nothing to change - the dep is in the form RPATH_PREFIX + name, and the first file with that name
+    # in the search paths is a lib, not a symlink to a lib with some other name.
+    dep_name = dep[len(RPATH_PREFIX) :]
+    if not dep.startswith(RPATH_PREFIX) or "/" in dep_name:
+        return False
+    for search_path in search_paths:
+        entry = get_dir_index(search_path).get(dep_name)
+        if entry is not None and entry.is_file():
+            return not entry.is_symlink()
+    return False
+
+
+def fix_dep_linkage(root_path, lib_paths_list, make_fatal=False, verbose=False):
     env_lib_path = root_path / VENDOR_ARCHIVE_CONTENTS / "env" / "lib"
 
     problems = []
-    for path_to_lib in lib_paths(root_path):
-        install_name = get_install_name(path_to_lib)
+    scan_libs(lib_paths_list)
+
+    for path_to_lib in lib_paths_list:
+        metadata = get_lib_metadata(path_to_lib)
         search_paths = [
             env_lib_path,
             path_to_lib.parents[0],
         ]
         deps_to_change = []
 
-        for dep in get_deps(path_to_lib):
-            if dep == install_name:
+        for dep in metadata.deps:
+            if dep == metadata.install_name:
+                continue
+            if is_linked_by_name(dep, search_paths):
                 continue
             result, found_path = find_dep(dep, search_paths)
             if result != VENDOR_DEP_FOUND:
@@ -658,12 +1475,12 @@ def fix_dep_linkage(root_path, make_fatal=False, verbose=False):
     for problem in problems:
         path_to_lib = problem["lib"]
         for dep, proposed_dep in problem["deps_to_change"]:
-            change_dep(path_to_lib, dep, proposed_dep)
+            queue_edits(path_to_lib).changed_deps.append((dep, proposed_dep))
 
     return MODIFIED
 
 
-def fix_everything(input_path, output_path):
+def fix_everything(input_path, output_path, verify=False):
     if not input_path.resolve().exists():
         fatal(f"Path does not exist {input_path}")
 
@@ -679,25 +1496,32 @@ def fix_everything(input_path, output_path):
         root_path = Path(root_path)
         unpack_all(input_path, root_path)
 
+        lib_paths_list = list(lib_paths(root_path))
+
+        applied_edits = {}
         status = UNMODIFIED
-        status |= fix_unsatisfied_deps(root_path)
-        status |= fix_dep_linkage(root_path)
-        status |= fix_names(root_path)
-        status |= fix_rpaths(root_path)
+        # Each fixer keeps lib_paths_list up to date with any libs it copies or renames.
+        status |= fix_unsatisfied_deps(root_path, lib_paths_list)
+        status |= fix_dep_linkage(root_path, lib_paths_list)
+        status |= fix_names(root_path, lib_paths_list)
+        status |= fix_rpaths(root_path, lib_paths_list)
 
         if status == MODIFIED:
+            applied_edits = apply_all_edits()
             checkmark("Finished fixing.\n")
             info("Checking everything was fixed ...")
-            kwargs = {"make_fatal": True, "verbose": True}
-            fix_unsatisfied_deps(root_path, **kwargs)
-            fix_dep_linkage(root_path, **kwargs)
-            fix_names(root_path, **kwargs)
-            fix_rpaths(root_path, **kwargs)
+            check_edits(root_path, applied_edits)
+            if verify:
+                kwargs = {"make_fatal": True, "verbose": True}
+                fix_unsatisfied_deps(root_path, lib_paths_list, **kwargs)
+                fix_dep_linkage(root_path, lib_paths_list, **kwargs)
+                fix_names(root_path, lib_paths_list, **kwargs)
+                fix_rpaths(root_path, lib_paths_list, **kwargs)
         else:
             checkmark("Nothing to change.\n")
 
         if output_path:
-            pack_all(root_path, output_path)
+            pack_all(root_path, output_path, applied_edits.keys())
             checkmark(f"Wrote fixed archive to {output_path}")
         elif status == MODIFIED:
             warn("Archive was fixed, but not writing anywhere due to dry-run mode.")
@@ -710,12 +1534,16 @@ for symbol in list(globals().keys()):
         globals()[symbol] = globals()[f"{symbol}_{PLATFORM}"]
 
 
-args = sys.argv[1:]
-if len(args) not in (1, 2):
-    print(USAGE.strip(), file=sys.stderr)
-    sys.exit(1)
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    verify = "--verify" in args
+    if verify:
+        args.remove("--verify")
+    if len(args) not in (1, 2):
+        print(USAGE.strip(), file=sys.stderr)
+        sys.exit(1)
 
-input_path = Path(args[0])
-output_path = Path(args[1]) if len(args) == 2 else None
+    input_path = Path(args[0])
+    output_path = Path(args[1]) if len(args) == 2 else None
 
-fix_everything(input_path, output_path)
+    fix_everything(input_path, output_path, verify=verify)
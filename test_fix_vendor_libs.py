@@ -0,0 +1,121 @@
+from pathlib import Path
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from fix_vendor_libs import LibEdits, edit_elf_in_place
+
+
+def readelf_dynamic(path_to_lib):
+    # Read back with readelf rather than ElfFile, so the check doesn't share any code with the edit.
+    output = subprocess.check_output(["readelf", "-d", path_to_lib], text=True)
+    return re.findall(r"\((NEEDED|SONAME)\)\s+[^[]*\[([^\]]*)\]", output)
+
+
+@unittest.skipUnless(
+    platform.system() == "Linux" and shutil.which("gcc") and shutil.which("readelf"),
+    "needs gcc and readelf on Linux",
+)
+class EditElfInPlaceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def build_lib(self, name, source, *link_args):
+        (self.tmp / "src.c").write_text(source)
+        path = self.tmp / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        subprocess.check_call(
+            # --no-as-needed so that libc is always a NEEDED entry, whatever the distro's default.
+            [
+                "gcc",
+                "-shared",
+                "-fPIC",
+                "-Wl,--no-as-needed",
+                "-o",
+                path,
+                self.tmp / "src.c",
+                *link_args,
+            ],
+            cwd=self.tmp,
+        )
+        return path
+
+    def assert_edit(self, path_to_lib, edits, expect_in_place, expect_dynamic):
+        before = path_to_lib.read_bytes()
+        self.assertEqual(edit_elf_in_place(path_to_lib, edits), expect_in_place)
+        if not expect_in_place:
+            # Left for patchelf, so nothing should have been changed.
+            self.assertEqual(path_to_lib.read_bytes(), before)
+        self.assertEqual(readelf_dynamic(path_to_lib), expect_dynamic)
+
+    def test_tail_merged_string_is_not_overwritten(self):
+        # ld merges a string that is the tail of another, so both NEEDED entries share the same bytes.
+        bar = "int bar(void) { return 1; }"
+        self.build_lib("p/libbar.so", bar)
+        self.build_lib("x/p/libbar.so", bar)
+        abs_bar = str(self.tmp / "x/p/libbar.so")
+        lib = self.build_lib(
+            "libfoo.so",
+            "int bar(void); int foo(void) { return bar(); }",
+            "p/libbar.so",
+            abs_bar,
+        )
+        self.assert_edit(
+            lib,
+            LibEdits(changed_deps=[("p/libbar.so", "libq.so")]),
+            False,
+            [("NEEDED", "p/libbar.so"), ("NEEDED", abs_bar), ("NEEDED", "libc.so.6")],
+        )
+
+    def test_later_edit_sees_earlier_edit(self):
+        # The SONAME edit points at the string of NEEDED libbar.so, so the NEEDED edit can't overwrite it.
+        self.build_lib(
+            "libbar.so", "int bar(void) { return 1; }", "-Wl,-soname,libbar.so"
+        )
+        lib = self.build_lib(
+            "libfoo.so",
+            "int bar(void); int foo(void) { return bar(); }",
+            "-Wl,-soname,libfoo.so",
+            "-L.",
+            "-lbar",
+        )
+        self.assert_edit(
+            lib,
+            LibEdits(install_name="libbar.so", changed_deps=[("libbar.so", "libq.so")]),
+            False,
+            [("NEEDED", "libbar.so"), ("NEEDED", "libc.so.6"), ("SONAME", "libfoo.so")],
+        )
+
+    def test_several_edits_in_one_call(self):
+        self.build_lib("x/libbar.so", "int bar(void) { return 1; }")
+        self.build_lib("x/libbaz.so", "int baz(void) { return 2; }")
+        abs_bar, abs_baz = str(self.tmp / "x/libbar.so"), str(self.tmp / "x/libbaz.so")
+        lib = self.build_lib(
+            "libfoo.so",
+            "int bar(void); int baz(void); int foo(void) { return bar() + baz(); }",
+            "-Wl,-soname," + str(self.tmp / "libfoo.so"),
+            abs_bar,
+            abs_baz,
+        )
+        self.assert_edit(
+            lib,
+            LibEdits(
+                install_name="libfoo.so",
+                changed_deps=[(abs_bar, "libbar.so"), (abs_baz, "libbaz.so")],
+            ),
+            True,
+            [
+                ("NEEDED", "libbar.so"),
+                ("NEEDED", "libbaz.so"),
+                ("NEEDED", "libc.so.6"),
+                ("SONAME", "libfoo.so"),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()